@@ -1,4 +1,7 @@
 import os
+import shlex
+import string
+import subprocess
 import sys
 
 # --- Core Settings ---
@@ -25,6 +28,9 @@ print(f"Total Iterations: {num_iterations} (Total time: {num_iterations * 20} ps
 print(f"Command: {lammps_command}")
 print("---------------------------------------")
 
+# Split the command once; LAMMPS is started directly without a shell
+lammps_argv = shlex.split(lammps_command)
+
 # 1. Read template file content
 try:
     with open(template_file, 'r', encoding="utf-8") as f:
@@ -34,7 +40,30 @@ except FileNotFoundError:
     print("Please ensure this file is in the same directory as this Python script.")
     sys.exit(1)
 
-# 2. Start loop (Starting from 0 to match test0.data)
+# 2. Turn the template into a string.Template once
+# Lines to update get placeholders; any other '$' (LAMMPS variables) is escaped
+template_lines = []
+for line in original_lines:
+    stripped_line = line.strip()
+    if stripped_line.startswith(read_data_tag):
+        line = "read_data ${read_data}\n"
+    elif stripped_line.startswith(log_tag):
+        line = "log ${log_file}\n"
+    elif stripped_line.startswith("dump") and dump_tag in stripped_line:
+        line = "dump RTlmp all atom 500 ${dump_file}\n"
+    # Ensure write_data is updated correctly
+    elif stripped_line.startswith(write_data_tag):
+        line = "write_data ${write_data}\n"
+    else:
+        line = line.replace("$", "$$")
+    template_lines.append(line)
+
+input_template = string.Template("".join(template_lines))
+
+# A single input file name is reused (overwritten) by every iteration
+temp_input_file = "lmp_current_input.in"
+
+# 3. Start loop (Starting from 0 to match test0.data)
 for i in range(num_iterations):  # Loop 0, 1, 2, ..., 1999
     
     # Define file names for this iteration
@@ -42,12 +71,11 @@ for i in range(num_iterations):  # Loop 0, 1, 2, ..., 1999
     write_data_file = f"{data_file_prefix}{i + 1}.data"    # i=0: test1.data
     lammpstrj_file = f"trajectory_strj_{i + 1}.lammpstrj" # i=0: ..._1.lammpstrj
     log_file = f"thermodata_{i + 1}.log"       # i=0: ..._1.log
-    temp_input_file = f"temp_input_{i + 1}.in"   # i=0: ..._1.in
     
     # Log progress (+1 so printing starts from "Loop 1")
     print(f"\n>>> Iteration {i + 1}/{num_iterations}...") 
 
-    # 3. Check if the input file from the previous step exists
+    # 4. Check if the input file from the previous step exists
     if not os.path.exists(read_data_file):
         print(f"ERROR: Input file {read_data_file} does not exist!")
         print("The simulation may have failed in the previous step. Stopping loop.")
@@ -55,40 +83,28 @@ for i in range(num_iterations):  # Loop 0, 1, 2, ..., 1999
     
     print(f"  Reading: {read_data_file}")
 
-    # 4. Create new temporary input file
-    new_lines = []
-    for line in original_lines:
-        stripped_line = line.strip()
-
-        # Update filenames based on current iteration
-        if stripped_line.startswith(read_data_tag):
-            line = f"read_data {read_data_file}\n"
-        elif stripped_line.startswith(log_tag):
-            line = f"log {log_file}\n"
-        elif stripped_line.startswith("dump") and dump_tag in stripped_line:
-            line = f"dump RTlmp all atom 500 {lammpstrj_file}\n"
-        # Ensure write_data is updated correctly
-        elif stripped_line.startswith(write_data_tag):
-            line = f"write_data {write_data_file}\n"
-        
-        new_lines.append(line)
-
-    # 5. Write temporary input file
+    # 5. Update filenames based on current iteration
+    content = input_template.substitute(read_data=read_data_file, log_file=log_file,
+                                        dump_file=lammpstrj_file, write_data=write_data_file)
+
+    # 6. Write temporary input file
     try:
-        with open(temp_input_file, 'w', encoding="utf-8") as f:
-            f.writelines(new_lines)
+        with open(temp_input_file, 'w', encoding="utf-8", buffering=1 << 16) as f:
+            f.write(content)
     except IOError as e:
         print(f"ERROR: Unable to write temporary file {temp_input_file}: {e}")
         break
 
-    # 6. Run LAMMPS
+    # 7. Run LAMMPS
     print(f"  Executing: {lammps_command} -in {temp_input_file}")
-    run_command = f"{lammps_command} -in {temp_input_file}"
-    
-    # os.system waits for the command to finish
-    exit_code = os.system(run_command)
+    # subprocess.run waits for the command to finish
+    try:
+        exit_code = subprocess.run(lammps_argv + ["-in", temp_input_file]).returncode
+    except OSError as e:
+        print(f"ERROR: Unable to start LAMMPS: {e}")
+        break
 
-    # 7. Check if LAMMPS ran successfully
+    # 8. Check if LAMMPS ran successfully
     if exit_code != 0:
         print(f"ERROR: LAMMPS returned error code {exit_code} at iteration {i + 1}.")
         print(f"Please check the log file {log_file} and output.")
@@ -97,7 +113,9 @@ for i in range(num_iterations):  # Loop 0, 1, 2, ..., 1999
     else:
         print(f"  Success: Generated {write_data_file}")
 
-    # 8. [Cleanup] Remove the temporary input file used
+else:
+    # 9. [Cleanup] Remove the temporary input file once all iterations succeeded
+    # (on failure it is kept for inspection)
     try:
         os.remove(temp_input_file)
     except OSError as e:
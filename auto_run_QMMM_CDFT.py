@@ -3,9 +3,15 @@ import os
 import shutil
 import subprocess
 import glob
+import fnmatch
 import re
+import shlex
 import sys
 import codecs
+import functools
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # ==================== User Configuration ====================
 
@@ -33,55 +39,109 @@ TEMPLATE_HAB_NAME  = "template_coupling.inp" # Previously A_B_coupling.inp
 # Use 16 if you want to run 2 instances on a 32-core machine.
 OMP_NUM_THREADS = 32
 
-# The command now exports the thread limit before running
-CP2K_CMD_TEMPLATE = "export OMP_NUM_THREADS={threads} && cp2k.ssmp -i {inp} | tee {out}"
+# CP2K is started without a shell; OMP_NUM_THREADS is passed through its
+# environment and the output is echoed to the screen and to the .out file
+CP2K_CMD_TEMPLATE = "cp2k.ssmp -i {inp}"
+
+# 6. Parallel Molecules
+# Number of molecules calculated at the same time (1 = one after another).
+# Each CP2K instance uses OMP_NUM_THREADS cores and is pinned to its own block
+# of the CPUs this process may use, in CPU-number order. With SMT, check that
+# these blocks are separate physical cores before raising this,
+# e.g. 2 on a 32-core machine with OMP_NUM_THREADS = 16.
+MAX_CONCURRENT_MOLS = 1
+
+# 7. Output Scanning
+# Only the end of CP2K output files is read when looking for results
+FOOTER_TAIL_BYTES   = 64 * 1024
+STRENGTH_TAIL_BYTES = 256 * 1024
+
+# Strengths already extracted are remembered here (keyed by output file and
+# its modification time), so restarted runs do not re-scan finished outputs
+STRENGTH_CACHE_FILE = ".strength_cache.json"
 
 # ==================== Core Logic ====================
 
-def get_file_pattern(pattern):
-    """Find a file matching the pattern in current directory."""
-    files = glob.glob(pattern)
+# Regex patterns are compiled once here instead of on every call.
+# Inputs and outputs are handled as raw bytes, so the patterns are bytes too.
+_RE_MM_INDEX_NUM = re.compile(rb'\b\d+\b')  # Whole numbers only
+_RE_MM_LINE      = re.compile(rb'^([^\n]*MM_INDEX[^\n]*)$', re.MULTILINE)
+_RE_STRENGTH     = re.compile(rb"Strength of constraint\s*:\s*([-+]?\d*\.\d+)")
+_RE_PROJECT      = re.compile(rb"PROJECT\s+[^\r\n]*")
+_RE_COORD        = re.compile(rb"COORD_FILE_NAME\s+[^\r\n]*")
+_RE_WFN_GACA     = re.compile(rb"WFN_RESTART_FILE_NAME\s+[^\r\n]*GACA[^\r\n]*", re.IGNORECASE)
+_RE_WFN_GACB     = re.compile(rb"WFN_RESTART_FILE_NAME\s+[^\r\n]*GACB[^\r\n]*", re.IGNORECASE)
+_RE_STRENGTH_VAL = re.compile(rb"STRENGTH\s+[\-\d\.]+")
+_RE_FORCE_EVAL   = re.compile(rb"&FORCE_EVAL")
+
+def list_dir_files(path):
+    """Snapshot the file names in a directory with a single scandir call."""
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+def get_file_pattern(pattern, names=None):
+    """
+    Find a file matching the pattern in current directory.
+    If a snapshot from list_dir_files is given, bare names are matched against it;
+    patterns containing a directory always go through glob.
+    """
+    if names is None or os.path.dirname(pattern):
+        files = glob.glob(pattern)
+    else:
+        files = sorted(n for n in fnmatch.filter(names, pattern) if not n.startswith('.'))
     return files[0] if files else None
 
-def read_file_safe(filepath):
+def read_bytes(filepath):
     """
-    Robust file reading function.
-    Tries multiple encodings to handle files with Chinese characters (GBK/UTF-8).
+    Read a whole file as bytes.
+    CP2K keywords are ASCII, so no decoding is needed (comments in any
+    encoding, e.g. GBK/UTF-8 Chinese, are passed through unchanged).
     """
-    if not os.path.exists(filepath):
+    try:
+        with open(filepath, 'rb', buffering=1 << 20) as f:
+            return f.read()
+    except FileNotFoundError:
         print(f"    [Error] File not found: {filepath}")
         return None
 
-    # List of encodings to try. 
-    encodings_to_try = ['utf-8', 'gb18030', 'latin-1']
+def read_tail(filepath, nbytes):
+    """
+    Read only the last nbytes of a file (CP2K footers are always at the end).
+    Returns None if the file does not exist.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            start = max(0, size - nbytes)
+            buf = bytearray(size - start)
+            f.seek(start)
+            f.readinto(buf)
+    except FileNotFoundError:
+        return None
+    return bytes(buf)
 
-    for enc in encodings_to_try:
-        try:
-            with open(filepath, 'r', encoding=enc) as f:
-                return f.read()
-        except UnicodeDecodeError:
-            continue
-    
-    # If all fail, read with ignore errors
-    print(f"    [Warning] Could not decode {filepath} with standard encodings. Ignoring errors.")
-    with open(filepath, 'r', errors='ignore') as f:
-        return f.read()
+def find_last_strength(content):
+    """Return the last 'Strength of constraint' value in content, or None."""
+    last_strength = None
+    # Regex to match: Strength of constraint : -0.08735...
+    for match in _RE_STRENGTH.finditer(content):
+        last_strength = match.group(1)
+    return last_strength.decode('ascii') if last_strength else None
 
 def extract_strength(output_file):
     """Extract the last 'Strength of constraint' from output file."""
-    content = read_file_safe(output_file)
+    # The final SCF block is near the end, so only the tail is scanned first
+    content = read_tail(output_file, STRENGTH_TAIL_BYTES)
     if content is None:
+        print(f"    [Error] File not found: {output_file}")
         return None
 
-    last_strength = None
-    # Regex to match: Strength of constraint : -0.08735...
-    regex = re.compile(r"Strength of constraint\s*:\s*([-+]?\d*\.\d+)")
+    last_strength = find_last_strength(content)
+    if not last_strength and len(content) >= STRENGTH_TAIL_BYTES:
+        # Not in the tail; fall back to scanning the whole file
+        content = read_bytes(output_file)
+        last_strength = find_last_strength(content) if content else None
 
-    for line in content.splitlines():
-        match = regex.search(line)
-        if match:
-            last_strength = match.group(1)
-    
     if last_strength:
         print(f"    [Success] Found Strength: {last_strength}")
         return last_strength
@@ -89,15 +149,51 @@ def extract_strength(output_file):
         print(f"    [Warning] Strength not found in {output_file}")
         return None
 
+def load_strength_cache(cache_path):
+    """Load the strength cache, returning an empty dict if missing or unreadable."""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_strength_cache(cache_path, cache):
+    """Write the strength cache atomically (temporary file + rename)."""
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"    [Warning] Could not save strength cache {cache_path}: {e}")
+
+def extract_strength_cached(output_file, cache, updates):
+    """
+    extract_strength() with memoization on (file, mtime).
+    New results are added to updates so the caller can merge and save them.
+    """
+    try:
+        mtime = os.stat(output_file).st_mtime_ns
+    except OSError:
+        return extract_strength(output_file)
+
+    entry = cache.get(output_file)
+    if entry and entry[0] == mtime:
+        print(f"    [Cache] Strength for {output_file}: {entry[1]}")
+        return entry[1]
+
+    strength = extract_strength(output_file)
+    if strength:
+        updates[output_file] = [mtime, strength]
+    return strength
+
 def is_calc_finished(filepath):
     """
     Check if the calculation finished successfully by looking for CP2K's footer.
     """
-    if not os.path.exists(filepath):
-        return False
-    
-    content = read_file_safe(filepath)
-    if content and "PROGRAM ENDED AT" in content:
+    content = read_tail(filepath, FOOTER_TAIL_BYTES)
+    if content and b"PROGRAM ENDED AT" in content:
         return True
     return False
 
@@ -107,16 +203,14 @@ def update_mm_index(content, atom_offset):
         return content
 
     def replace_func(match):
-        return str(int(match.group(0)) + atom_offset)
+        return str(int(match.group(0)) + atom_offset).encode()
+
+    # Only lines containing MM_INDEX are matched, so the whole file is
+    # rewritten in a single pass without splitting it into lines
+    def line_func(match):
+        return _RE_MM_INDEX_NUM.sub(replace_func, match.group(1))
 
-    lines = content.split('\n')
-    new_lines = []
-    for line in lines:
-        if "MM_INDEX" in line:
-            # Regex \b\d+\b matches whole numbers only
-            line = re.sub(r'\b\d+\b', replace_func, line)
-        new_lines.append(line)
-    return '\n'.join(new_lines)
+    return _RE_MM_LINE.sub(line_func, content)
 
 def generate_input(template_file, new_file, proj_name, xyz_file, atom_offset, 
                    wfn_replace_map=None, strength_map=None):
@@ -124,16 +218,16 @@ def generate_input(template_file, new_file, proj_name, xyz_file, atom_offset,
     Generate new input file from template.
     Handles PROJECT, XYZ, MM_INDEX, WFN paths, and Strength injection.
     """
-    content = read_file_safe(template_file)
+    content = read_bytes(template_file)
     if content is None:
         return False
 
     # 1. Modify PROJECT
-    content = re.sub(r"PROJECT\s+.*", f"PROJECT {proj_name}", content)
+    content = _RE_PROJECT.sub(f"PROJECT {proj_name}".encode(), content)
 
     # 2. Modify XYZ filename (if COORD_FILE_NAME exists)
     if xyz_file:
-        content = re.sub(r"COORD_FILE_NAME\s+.*", f"COORD_FILE_NAME {xyz_file}", content)
+        content = _RE_COORD.sub(f"COORD_FILE_NAME {xyz_file}".encode(), content)
 
     # 3. Update MM_INDEX
     content = update_mm_index(content, atom_offset)
@@ -142,66 +236,187 @@ def generate_input(template_file, new_file, proj_name, xyz_file, atom_offset,
     if wfn_replace_map:
         # Try replacing GACA WFN path
         if 'GACA' in wfn_replace_map:
-            content = re.sub(r"WFN_RESTART_FILE_NAME\s+.*GACA.*", 
-                             f"WFN_RESTART_FILE_NAME {wfn_replace_map['GACA']}", content, flags=re.IGNORECASE)
+            content = _RE_WFN_GACA.sub(f"WFN_RESTART_FILE_NAME {wfn_replace_map['GACA']}".encode(), content)
         
         # Try replacing GACB WFN path
         if 'GACB' in wfn_replace_map:
-            content = re.sub(r"WFN_RESTART_FILE_NAME\s+.*GACB.*", 
-                             f"WFN_RESTART_FILE_NAME {wfn_replace_map['GACB']}", content, flags=re.IGNORECASE)
+            content = _RE_WFN_GACB.sub(f"WFN_RESTART_FILE_NAME {wfn_replace_map['GACB']}".encode(), content)
 
     # 5. (For Coupling) Inject Strength
     if strength_map:
-        parts = content.split("&FORCE_EVAL")
-        # Structure assumption: [0]Header -> [1]Mixed -> [2]GACA -> [3]GACB
-        if len(parts) >= 4:
+        offsets = [m.start() for m in _RE_FORCE_EVAL.finditer(content)]
+        # Structure assumption: Header -> [0]Mixed -> [1]GACA -> [2]GACB
+        if len(offsets) >= 3:
+            gaca_start, gacb_start = offsets[1], offsets[2]
+            gacb_end = offsets[3] if len(offsets) >= 4 else len(content)
+            gaca_section = content[gaca_start:gacb_start]
+            gacb_section = content[gacb_start:gacb_end]
+
             # Inject GACA Strength
             if 'GACA' in strength_map and strength_map['GACA']:
-                parts[2] = re.sub(r"STRENGTH\s+[\-\d\.]+", f"STRENGTH {strength_map['GACA']}", parts[2])
+                gaca_section = _RE_STRENGTH_VAL.sub(f"STRENGTH {strength_map['GACA']}".encode(), gaca_section)
             
             # Inject GACB Strength
             if 'GACB' in strength_map and strength_map['GACB']:
-                parts[3] = re.sub(r"STRENGTH\s+[\-\d\.]+", f"STRENGTH {strength_map['GACB']}", parts[3])
+                gacb_section = _RE_STRENGTH_VAL.sub(f"STRENGTH {strength_map['GACB']}".encode(), gacb_section)
             
-            content = "&FORCE_EVAL".join(parts)
+            content = content[:gaca_start] + gaca_section + gacb_section + content[gacb_end:]
         else:
             print("[Warning] FORCE_EVAL structure mismatch, Strength injection might fail.")
 
-    # Save with UTF-8 encoding to prevent future issues
-    with open(new_file, 'w', encoding='utf-8') as f:
+    with open(new_file, 'wb') as f:
         f.write(content)
     return True
 
-def run_cp2k(inp_file, out_file):
-    """Run CP2K command."""
-    # Pass the thread count to the command template
-    cmd = CP2K_CMD_TEMPLATE.format(inp=inp_file, out=out_file, threads=OMP_NUM_THREADS)
-    print(f"    [Running] {cmd}")
+def run_cp2k(inp_file, out_file, echo=True):
+    """
+    Run CP2K command, writing its output to out_file and the screen (like tee).
+    With echo=False the output only goes to out_file.
+    """
+    cmd = shlex.split(CP2K_CMD_TEMPLATE.format(inp=inp_file))
+    # Pass the thread count through the environment
+    env = dict(os.environ, OMP_NUM_THREADS=str(OMP_NUM_THREADS))
+    print(f"    [Running] OMP_NUM_THREADS={OMP_NUM_THREADS} {' '.join(cmd)} > {out_file}")
     try:
-        # shell=True allows pipe usage and executing the export command
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError:
+        with open(out_file, 'wb') as fout:
+            if not echo:
+                returncode = subprocess.run(cmd, stdout=fout, env=env).returncode
+            else:
+                with subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env) as proc:
+                    for chunk in iter(lambda: proc.stdout.read1(65536), b''):
+                        fout.write(chunk)
+                        sys.stdout.buffer.write(chunk)
+                        sys.stdout.flush()
+                returncode = proc.returncode
+    except OSError as e:
+        print(f"    [Error] Could not start CP2K for {inp_file}: {e}")
+        return
+    if returncode != 0:
         print(f"    [Error] Calculation failed for {inp_file}")
 
+def process_molecule(i, tpl_gaca, tpl_gacb, tpl_hab, current_xyz, work_dir, strength_cache,
+                     echo=True):
+    """
+    Run GACA, GACB and coupling calculations for molecule i.
+    Returns the new strength cache entries found for this molecule.
+    """
+    cache_updates = {}
+    print(f"\n{'='*40}\nProcessing Molecule {i}\n{'='*40}")
+    
+    # This formula calculates the atom offset based on the reference (49)
+    # But it does not depend on the FILE named mol49.
+    offset = (i - BASE_MOL_IDX) * ATOMS_PER_MOL
+    
+    # Define filenames
+    proj_gaca = f"mol{i}_GACA"
+    inp_gaca  = f"{proj_gaca}.inp"
+    out_gaca  = f"{proj_gaca}.out"
+    wfn_gaca  = f"{proj_gaca}-RESTART.wfn" # Auto-generated name by CP2K
+
+    proj_gacb = f"mol{i}_GACB"
+    inp_gacb  = f"{proj_gacb}.inp"
+    out_gacb  = f"{proj_gacb}.out"
+    wfn_gacb  = f"{proj_gacb}-RESTART.wfn"
+
+    proj_hab  = f"mol{i}_AB_coupling"
+    inp_hab   = f"{proj_hab}.inp"
+    out_hab   = f"{proj_hab}.out"
+
+    # Snapshot the directory once; refreshed after each CP2K run
+    cwd_files = list_dir_files(work_dir)
+
+    # --- 1. GACA ---
+    print("--- Step 1: GACA ---")
+    if out_gaca in cwd_files and is_calc_finished(out_gaca):
+        print(f"    [Skip] {out_gaca} already finished successfully.")
+    else:
+        if out_gaca in cwd_files:
+            print(f"    [Info] Found incomplete {out_gaca}, re-running...")
+        # Use the explicit template variable
+        generate_input(tpl_gaca, inp_gaca, proj_gaca, current_xyz, offset)
+        run_cp2k(inp_gaca, out_gaca, echo)
+        cwd_files = list_dir_files(work_dir)
+    strength_gaca = extract_strength_cached(out_gaca, strength_cache, cache_updates)
+
+    # --- 2. GACB ---
+    print("--- Step 2: GACB ---")
+    if out_gacb in cwd_files and is_calc_finished(out_gacb):
+        print(f"    [Skip] {out_gacb} already finished successfully.")
+    else:
+        if out_gacb in cwd_files:
+            print(f"    [Info] Found incomplete {out_gacb}, re-running...")
+        # Use the explicit template variable
+        generate_input(tpl_gacb, inp_gacb, proj_gacb, current_xyz, offset)
+        run_cp2k(inp_gacb, out_gacb, echo)
+        cwd_files = list_dir_files(work_dir)
+    strength_gacb = extract_strength_cached(out_gacb, strength_cache, cache_updates)
+
+    # --- 3. Coupling ---
+    print("--- Step 3: Coupling ---")
+    if not strength_gaca or not strength_gacb:
+        print("[Error] Missing Strength, skipping coupling.")
+        return cache_updates
+    
+    # Check if WFN exists
+    if wfn_gaca not in cwd_files or wfn_gacb not in cwd_files:
+        print(f"[Error] WFN missing: {wfn_gaca} or {wfn_gacb}")
+        return cache_updates
+
+    if out_hab in cwd_files and is_calc_finished(out_hab):
+         print(f"    [Skip] {out_hab} already finished successfully.")
+    else:
+        # Use the explicit template variable
+        generate_input(tpl_hab, inp_hab, proj_hab, current_xyz, offset,
+                       wfn_replace_map={'GACA': wfn_gaca, 'GACB': wfn_gacb},
+                       strength_map={'GACA': strength_gaca, 'GACB': strength_gacb})
+        run_cp2k(inp_hab, out_hab, echo)
+    
+    print(f"[DONE] Molecule {i} finished.")
+    return cache_updates
+
+def usable_cpus():
+    """CPUs this process may run on (respects affinity, cgroup/SLURM cpusets)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def init_worker(slot_counter):
+    """
+    Give each pool worker its own block of OMP_NUM_THREADS cores.
+    CP2K processes started by the worker inherit this CPU affinity.
+    """
+    with slot_counter.get_lock():
+        slot = slot_counter.value
+        slot_counter.value += 1
+
+    if hasattr(os, "sched_setaffinity"):
+        cpus = usable_cpus()
+        block = cpus[slot * OMP_NUM_THREADS:(slot + 1) * OMP_NUM_THREADS]
+        if block:
+            os.sched_setaffinity(0, block)
+        else:
+            print(f"[Warning] No free CPU block for worker {slot}; it is not pinned.")
+
 def main():
     work_dir = os.getcwd()
     print(f"[Init] Working Directory: {work_dir}")
 
     # Use the User Configured template names
     # Priority: Explicit configuration -> Fallback check
-    tpl_gaca = get_file_pattern(TEMPLATE_GACA_NAME)
-    tpl_gacb = get_file_pattern(TEMPLATE_GACB_NAME)
-    tpl_hab  = get_file_pattern(TEMPLATE_HAB_NAME)
+    cwd_files = list_dir_files(work_dir)
+    tpl_gaca = get_file_pattern(TEMPLATE_GACA_NAME, cwd_files)
+    tpl_gacb = get_file_pattern(TEMPLATE_GACB_NAME, cwd_files)
+    tpl_hab  = get_file_pattern(TEMPLATE_HAB_NAME, cwd_files)
     
-    current_xyz = get_file_pattern("*.xyz")
+    current_xyz = get_file_pattern("*.xyz", cwd_files)
 
     # Validate templates exist
-    if not tpl_gaca or not os.path.exists(tpl_gaca):
+    if not tpl_gaca:
         print(f"[Error] Template GACA not found: '{TEMPLATE_GACA_NAME}'")
         print(f"Please rename your old 'mol49_GACA.inp' to '{TEMPLATE_GACA_NAME}'")
         return
         
-    if not tpl_hab or not os.path.exists(tpl_hab):
+    if not tpl_hab:
         print(f"[Error] Template Coupling not found: '{TEMPLATE_HAB_NAME}'")
         return
     
@@ -212,73 +427,40 @@ def main():
 
     print(f"[Init] Using Templates:\n  - GACA: {tpl_gaca}\n  - GACB: {tpl_gacb}\n  - XYZ : {current_xyz}")
 
-    for i in range(START_MOL, END_MOL + 1):
-        print(f"\n{'='*40}\nProcessing Molecule {i}\n{'='*40}")
-        
-        # This formula calculates the atom offset based on the reference (49)
-        # But it does not depend on the FILE named mol49.
-        offset = (i - BASE_MOL_IDX) * ATOMS_PER_MOL
-        
-        # Define filenames
-        proj_gaca = f"mol{i}_GACA"
-        inp_gaca  = f"{proj_gaca}.inp"
-        out_gaca  = f"{proj_gaca}.out"
-        wfn_gaca  = f"{proj_gaca}-RESTART.wfn" # Auto-generated name by CP2K
-
-        proj_gacb = f"mol{i}_GACB"
-        inp_gacb  = f"{proj_gacb}.inp"
-        out_gacb  = f"{proj_gacb}.out"
-        wfn_gacb  = f"{proj_gacb}-RESTART.wfn"
-
-        proj_hab  = f"mol{i}_AB_coupling"
-        inp_hab   = f"{proj_hab}.inp"
-        out_hab   = f"{proj_hab}.out"
-
-        # --- 1. GACA ---
-        print("--- Step 1: GACA ---")
-        if is_calc_finished(out_gaca):
-            print(f"    [Skip] {out_gaca} already finished successfully.")
-        else:
-            if os.path.exists(out_gaca):
-                print(f"    [Info] Found incomplete {out_gaca}, re-running...")
-            # Use the explicit template variable
-            generate_input(tpl_gaca, inp_gaca, proj_gaca, current_xyz, offset)
-            run_cp2k(inp_gaca, out_gaca)
-        strength_gaca = extract_strength(out_gaca)
-
-        # --- 2. GACB ---
-        print("--- Step 2: GACB ---")
-        if is_calc_finished(out_gacb):
-            print(f"    [Skip] {out_gacb} already finished successfully.")
-        else:
-            if os.path.exists(out_gacb):
-                print(f"    [Info] Found incomplete {out_gacb}, re-running...")
-            # Use the explicit template variable
-            generate_input(tpl_gacb, inp_gacb, proj_gacb, current_xyz, offset)
-            run_cp2k(inp_gacb, out_gacb)
-        strength_gacb = extract_strength(out_gacb)
-
-        # --- 3. Coupling ---
-        print("--- Step 3: Coupling ---")
-        if not strength_gaca or not strength_gacb:
-            print("[Error] Missing Strength, skipping coupling.")
-            continue
-        
-        # Check if WFN exists
-        if not os.path.exists(wfn_gaca) or not os.path.exists(wfn_gacb):
-            print(f"[Error] WFN missing: {wfn_gaca} or {wfn_gacb}")
-            continue
-
-        if is_calc_finished(out_hab):
-             print(f"    [Skip] {out_hab} already finished successfully.")
-        else:
-            # Use the explicit template variable
-            generate_input(tpl_hab, inp_hab, proj_hab, current_xyz, offset,
-                           wfn_replace_map={'GACA': wfn_gaca, 'GACB': wfn_gacb},
-                           strength_map={'GACA': strength_gaca, 'GACB': strength_gacb})
-            run_cp2k(inp_hab, out_hab)
-        
-        print(f"[DONE] Molecule {i} finished.")
+    cache_path = os.path.join(work_dir, STRENGTH_CACHE_FILE)
+    strength_cache = load_strength_cache(cache_path)
+
+    # Never run more molecules than there are OMP_NUM_THREADS blocks of usable CPUs
+    n_concurrent = max(1, MAX_CONCURRENT_MOLS)
+    n_blocks = max(1, len(usable_cpus()) // OMP_NUM_THREADS)
+    if n_concurrent > n_blocks:
+        print(f"[Warning] MAX_CONCURRENT_MOLS = {MAX_CONCURRENT_MOLS} needs more CPUs than available "
+              f"({len(usable_cpus())} usable, {OMP_NUM_THREADS} per CP2K). Using {n_blocks}.")
+        n_concurrent = n_blocks
+
+    # Parallel runs would interleave on screen, so CP2K output then only goes to files
+    run_one = functools.partial(process_molecule, tpl_gaca=tpl_gaca, tpl_gacb=tpl_gacb,
+                                tpl_hab=tpl_hab, current_xyz=current_xyz, work_dir=work_dir,
+                                strength_cache=strength_cache, echo=(n_concurrent == 1))
+    molecules = range(START_MOL, END_MOL + 1)
+
+    if n_concurrent == 1:
+        for i in molecules:
+            cache_updates = run_one(i)
+            if cache_updates:
+                strength_cache.update(cache_updates)
+                save_strength_cache(cache_path, strength_cache)
+    else:
+        # Molecules are independent (separate inputs, outputs and WFN files)
+        print(f"[Init] Running {n_concurrent} molecules concurrently")
+        slot_counter = multiprocessing.Value('i', 0)
+        with ProcessPoolExecutor(max_workers=n_concurrent, initializer=init_worker,
+                                 initargs=(slot_counter,)) as pool:
+            # Workers only return new entries; the cache is saved from here
+            for cache_updates in pool.map(run_one, molecules):
+                if cache_updates:
+                    strength_cache.update(cache_updates)
+                    save_strength_cache(cache_path, strength_cache)
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import sys
 import re
+import mmap
 
 # =================================================================
 # --- User Configuration ---
@@ -14,9 +15,21 @@ MANUAL_NUM_OLIGOMERS = 64
 MANUAL_NUM_IONS = 48
 MANUAL_NUM_WATERS = 1624
 
+# I/O tuning: file buffer size and how many output lines to collect per write
+IO_BUFFER_SIZE = 1 << 20  # 1 MiB
+WRITE_CHUNK_LINES = 65536
 
 # =================================================================
 
+# Two-letter elements recognised from GAFF atom types (mol2) and PDB atom names
+_TWO_CHAR_ELEMS = {'cl': 'Cl', 'br': 'Br', 'na': 'Na', 'mg': 'Mg', 'fe': 'Fe'}
+_PDB_TWO_CHAR_ELEMS = {'CL': 'Cl', 'BR': 'Br'}
+
+# Output record formats; atom names are passed already centered to 4 columns
+_ATOM_FMT = "ATOM  %5d %s %-3s %4d    %8.3f%8.3f%8.3f  1.00  0.00\n"
+_EXTRACT_FMT = "ATOM  %5d %s MOL     1    %8.3f%8.3f%8.3f  1.00  0.00\n"
+
+
 def load_atom_names_from_mol2(mol2_file):
     """
     Extract atom names and element types from mol2 file.
@@ -40,18 +53,7 @@ def load_atom_names_from_mol2(mol2_file):
                         atom_type = parts[5].lower()
 
                         # --- Improved logic for converting GAFF types to element symbols ---
-                        if atom_type.startswith('cl'):
-                            element_guess = 'Cl'
-                        elif atom_type.startswith('br'):
-                            element_guess = 'Br'
-                        elif atom_type.startswith('na'):
-                            element_guess = 'Na'
-                        elif atom_type.startswith('mg'):
-                            element_guess = 'Mg'
-                        elif atom_type.startswith('fe'):
-                            element_guess = 'Fe'
-                        else:
-                            element_guess = atom_type[0].upper()
+                        element_guess = _TWO_CHAR_ELEMS.get(atom_type[:2]) or atom_type[0].upper()
 
                         atom_info.append((name, element_guess))
     except FileNotFoundError:
@@ -62,18 +64,18 @@ def load_atom_names_from_mol2(mol2_file):
 
 def get_pdb_element(line):
     """
-    Extract element from PDB line.
+    Extract element from PDB line (raw bytes record).
     """
     # 1. Try reading Element column (76-78)
     if len(line) >= 78:
-        elem = line[76:78].strip()
+        elem = line[76:78].decode('ascii', 'ignore').strip()
         if elem: return elem.capitalize()
 
     # 2. Fallback to extracting from atom name (12-16)
-    name = line[12:16].strip()
+    name = line[12:16].decode('ascii', 'ignore').strip()
     elem = re.sub(r'[^A-Za-z]', '', name)
-    if elem.upper().startswith('CL'): return 'Cl'
-    if elem.upper().startswith('BR'): return 'Br'
+    two_char = _PDB_TWO_CHAR_ELEMS.get(elem[:2].upper())
+    if two_char: return two_char
     if elem.startswith('H'): return 'H'
 
     return elem.capitalize()
@@ -97,20 +99,14 @@ def auto_detect_counts(atom_lines, atoms_per_olig):
 
     # 1. Scan Oligomers
     # Pattern: The atom names of the first oligomer
-    pattern_names = [line[12:16].strip() for line in atom_lines[:atoms_per_olig]]
+    # Whole oligomers are compared as list slices (element-wise in C)
+    names = [line[12:16].strip() for line in atom_lines]
+    pattern_names = names[:atoms_per_olig]
 
     current_index = 0
     num_olig = 0
     while current_index + atoms_per_olig <= len(atom_lines):
-        matches = True
-        for j in range(atoms_per_olig):
-            line = atom_lines[current_index + j]
-            name = line[12:16].strip()
-            if name != pattern_names[j]:
-                matches = False
-                break
-
-        if matches:
+        if names[current_index:current_index + atoms_per_olig] == pattern_names:
             num_olig += 1
             current_index += atoms_per_olig
         else:
@@ -124,8 +120,8 @@ def auto_detect_counts(atom_lines, atoms_per_olig):
 
     while ion_scan_index < len(atom_lines):
         line = atom_lines[ion_scan_index]
-        res_name = line[17:20].strip().upper()
-        atom_name = line[12:16].strip().upper()
+        res_name = line[17:20].decode('ascii', 'ignore').strip().upper()
+        atom_name = line[12:16].decode('ascii', 'ignore').strip().upper()
 
         is_ion = (res_name in ION_NAMES or atom_name in ION_NAMES)
         is_water = (res_name in WATER_RES_NAMES) or (atom_name in WATER_ATOM_NAMES)
@@ -144,26 +140,14 @@ def auto_detect_counts(atom_lines, atoms_per_olig):
     # 3. Scan Waters
     water_start_index = ion_scan_index
     num_wat = 0
-    k = water_start_index
     water_pattern = ["O", "H", "H"]  # Element based pattern
 
-    while k + atoms_per_wat <= len(atom_lines):
-        matches = True
-        for j in range(atoms_per_wat):
-            line = atom_lines[k + j]
-            elem = get_pdb_element(line)  # Use robust helper
-            # Simple check: O, H, H
-            target = water_pattern[j]
-            # Fuzzy match for H
-            if target == "H" and elem == "H":
-                pass
-            elif target == "O" and elem == "O":
-                pass
-            else:
-                matches = False
-                break
-
-        if matches:
+    # Elements of the remaining atoms, using the robust helper
+    elems = [get_pdb_element(line) for line in atom_lines[water_start_index:]]
+    k = 0
+    while k + atoms_per_wat <= len(elems):
+        # Simple check: O, H, H
+        if elems[k:k + atoms_per_wat] == water_pattern:
             num_wat += 1
             k += atoms_per_wat
         else:
@@ -175,6 +159,57 @@ def auto_detect_counts(atom_lines, atoms_per_olig):
     return num_olig, num_ion, num_wat
 
 
+def parse_atom_columns(atom_lines):
+    """
+    Parse coordinates and elements of all ATOM lines column by column.
+    Returns (xs, ys, zs, elements, bad_index) lists aligned with atom_lines;
+    bad_index is the first line with invalid coordinates (len(atom_lines) if none).
+    The error itself is reported by check_coords when processing reaches it.
+    """
+    bad_index = len(atom_lines)
+    try:
+        xs = list(map(float, [line[30:38] for line in atom_lines]))
+        ys = list(map(float, [line[38:46] for line in atom_lines]))
+        zs = list(map(float, [line[46:54] for line in atom_lines]))
+    except ValueError:
+        # Slow path: parse line by line and remember the first offending line
+        xs, ys, zs = [], [], []
+        nan = float('nan')
+        for idx, line in enumerate(atom_lines):
+            try:
+                x, y, z = float(line[30:38]), float(line[38:46]), float(line[46:54])
+            except ValueError:
+                x = y = z = nan
+                bad_index = min(bad_index, idx)
+            xs.append(x)
+            ys.append(y)
+            zs.append(z)
+
+    elements = [get_pdb_element(line) for line in atom_lines]
+    return xs, ys, zs, elements, bad_index
+
+
+def check_coords(bad_index, last_idx):
+    """Exit if the first invalid coordinate line is at or before atom index last_idx."""
+    if bad_index <= last_idx:
+        print(f"[ERROR] Invalid coordinates at atom line {bad_index + 1}.")
+        sys.exit(1)
+
+
+def first_mismatch(found, expected):
+    """Index of the first element in found that differs from expected, or -1."""
+    if found == expected[:len(found)]:
+        return -1
+    return next(k for k, (a, b) in enumerate(zip(found, expected)) if a != b)
+
+
+def write_residue(out_buf, first_serial, atom_names, res_name, res_id, xs, ys, zs):
+    """Append the ATOM records of one residue, followed by TER, to out_buf."""
+    out_buf.extend(_ATOM_FMT % (first_serial + k, name, res_name, res_id, x, y, z)
+                   for k, (name, x, y, z) in enumerate(zip(atom_names, xs, ys, zs)))
+    out_buf.append("TER\n")
+
+
 def process_pdb(input_pdb, output_pdb, mol2_template):
     print(f"Processing '{input_pdb}' using template '{mol2_template}'...")
 
@@ -182,23 +217,28 @@ def process_pdb(input_pdb, output_pdb, mol2_template):
     oligomer_info = load_atom_names_from_mol2(mol2_template)
     atoms_per_oligomer = len(oligomer_info)
     print(f"Template loaded: {atoms_per_oligomer} atoms per oligomer.")
+    oligomer_atom_names = [name.center(4) for name, _ in oligomer_info]
 
-    # 2. Read All Lines
+    # 2. Read Lines, separating Header and Atom lines in a single pass
+    # The file is memory-mapped; atom lines stay as raw bytes records
+    header_lines = []
+    atom_lines = []
     try:
-        with open(input_pdb, 'r') as f:
-            all_lines = f.readlines()
+        with open(input_pdb, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                if line.startswith((b"ATOM", b"HETATM")):
+                    atom_lines.append(line)
+                elif line.startswith((b"CRYST1", b"REMARK", b"COMPND", b"HEADER", b"TITLE", b"AUTHOR")):
+                    # Undecodable bytes are kept via surrogateescape and restored on write
+                    header_lines.append(line.decode('utf-8', 'surrogateescape').replace('\r\n', '\n'))
+                elif line.startswith(b"CONECT") or line[:6].rstrip() == b"END":
+                    break  # Nothing after the coordinates is needed
     except FileNotFoundError:
         print(f"[ERROR] Input file '{input_pdb}' not found.")
         sys.exit(1)
-
-    # Separate Header and Atom lines
-    header_lines = []
-    atom_lines = []
-    for line in all_lines:
-        if line.startswith(("ATOM", "HETATM")):
-            atom_lines.append(line)
-        elif line.startswith(("CRYST1", "REMARK", "COMPND", "HEADER", "TITLE", "AUTHOR")):
-            header_lines.append(line)
+    except ValueError:
+        pass  # Empty file (cannot be mapped); auto-detection reports it
 
     # 3. Auto-Detect Counts
     num_oligomers, num_ions, num_waters = auto_detect_counts(atom_lines, atoms_per_oligomer)
@@ -209,152 +249,132 @@ def process_pdb(input_pdb, output_pdb, mol2_template):
         num_ions = MANUAL_NUM_IONS
         num_waters = MANUAL_NUM_WATERS
 
+    # Parse only the atoms that will actually be written
+    num_used = min(len(atom_lines), num_oligomers * atoms_per_oligomer + num_ions + 3 * num_waters)
+    xs, ys, zs, elements, bad_index = parse_atom_columns(atom_lines[:num_used])
+
     # 4. Prepare for Processing
-    # File handle for extracting the first molecule template
+    # The first molecule template is built in memory and written in one call
     extract_filename = "extracted_oligomer.pdb"
-    f_extract = open(extract_filename, 'w')
+    extract_buf = bytearray()
     extracting = True
     print(f"Preparing to extract the first oligomer to '{extract_filename}'...")
 
     ion_resname = "Cl-"
-    ion_atomname = "Cl-"
+    ion_atomname = "Cl-".center(4)
     water_resname = "WAT"
-    water_atom_names = ["O", "H1", "H2"]
+    water_atom_names = [name.center(4) for name in ("O", "H1", "H2")]
     water_elements = ["O", "H", "H"]
 
-    # 5. Main Processing Loop (Writing)
-    with open(output_pdb, 'w') as fout:
+    # 5. Main Processing (Writing)
+    # Each molecule is checked and formatted as a whole slice of the parsed atoms
+    with open(output_pdb, 'w', buffering=IO_BUFFER_SIZE, encoding='utf-8', errors='surrogateescape') as fout:
         # Write Headers
-        for h in header_lines: fout.write(h)
+        fout.write("".join(header_lines))
+
+        # Output lines are collected and written in large chunks
+        out_buf = []
+        out_buf_append = out_buf.append
 
         atom_counter = 0
         residue_counter = 0
+        atom_idx = 0  # Next unprocessed atom (0-based line_num - 1)
+        incomplete = False
+
+        # --- Oligomers ---
+        oligomer_elements = [element for _, element in oligomer_info]
+        for mol_idx in range(num_oligomers):
+            end = min(atom_idx + atoms_per_oligomer, num_used)
+            if end == atom_idx:
+                break
+            found = elements[atom_idx:end]
+
+            # Check Mismatch (a bad coordinate on an earlier or the same line comes first)
+            j = first_mismatch(found, oligomer_elements)
+            check_coords(bad_index, atom_idx + j if j >= 0 else end - 1)
+            if j >= 0:
+                target_name, target_element = oligomer_info[j]
+                print(f"\n[CRITICAL ERROR] Atom Mismatch (Oligomer) at line {atom_idx + j + 1}!")
+                print(f"  Expected: {target_name} ({target_element})")
+                print(f"  Found: {found[j]}")
+                sys.exit(1)
 
-        current_mol_type = "oligomer"
-        mol_idx = 0
-        atom_in_mol_idx = 0
-
-        current_residue_lines = []
+            mol_xs, mol_ys, mol_zs = xs[atom_idx:end], ys[atom_idx:end], zs[atom_idx:end]
 
-        # Iterate through ATOM lines only
-        for line_num, line in enumerate(atom_lines, 1):
+            # Extraction Logic
+            if extracting:
+                extract_buf += "".join(
+                    _EXTRACT_FMT % (k + 1, elem.center(4), x, y, z)
+                    for k, (elem, x, y, z) in enumerate(zip(found, mol_xs, mol_ys, mol_zs))).encode()
+                with open(extract_filename, 'wb', buffering=IO_BUFFER_SIZE) as f_extract:
+                    f_extract.write(extract_buf)
 
-            # --- Stop if we have processed all detected molecules ---
-            if current_mol_type == "done":
+            if end - atom_idx < atoms_per_oligomer:
+                incomplete = True
                 break
 
-            try:
-                x = float(line[30:38])
-                y = float(line[38:46])
-                z = float(line[46:54])
-            except ValueError:
-                print(f"[ERROR] Invalid coordinates at atom line {line_num}.")
+            residue_counter += 1
+            write_residue(out_buf, atom_counter + 1, oligomer_atom_names, "MOL",
+                          residue_counter, mol_xs, mol_ys, mol_zs)
+            atom_counter += atoms_per_oligomer
+            atom_idx = end
+            if len(out_buf) >= WRITE_CHUNK_LINES:
+                fout.write("".join(out_buf))
+                out_buf.clear()
+
+            if extracting:
+                extracting = False
+                extract_buf = None
+                print(f"-> Successfully extracted '{extract_filename}'. Use this for Antechamber!")
+
+        # --- Ions (one atom per residue) ---
+        end = min(atom_idx + num_ions, num_used) if not incomplete else atom_idx
+        j = first_mismatch(elements[atom_idx:end], ["Cl"] * (end - atom_idx))
+        check_coords(bad_index, atom_idx + j if j >= 0 else end - 1)
+        if j >= 0:
+            print(f"\n[CRITICAL ERROR] Ion Mismatch at line {atom_idx + j + 1}. Expected Cl, found {elements[atom_idx + j]}.")
+            sys.exit(1)
+
+        for x, y, z in zip(xs[atom_idx:end], ys[atom_idx:end], zs[atom_idx:end]):
+            atom_counter += 1
+            residue_counter += 1
+            out_buf_append(_ATOM_FMT % (atom_counter, ion_atomname, ion_resname, residue_counter, x, y, z))
+            out_buf_append("TER\n")
+        atom_idx = end
+
+        # --- Waters ---
+        for mol_idx in range(num_waters if not incomplete else 0):
+            end = min(atom_idx + 3, num_used)
+            if end == atom_idx:
+                break
+            found = elements[atom_idx:end]
+
+            j = first_mismatch(found, water_elements)
+            check_coords(bad_index, atom_idx + j if j >= 0 else end - 1)
+            if j >= 0:
+                print(
+                    f"\n[CRITICAL ERROR] Water Mismatch at line {atom_idx + j + 1}. Expected {water_elements[j]}, found {found[j]}.")
+                print("Possible missing atom in previous water molecule.")
                 sys.exit(1)
 
-            pdb_element = get_pdb_element(line)
-
-            # --- Logic ---
-            if current_mol_type == "oligomer":
-                res_name = "MOL"
-                target_name, target_element = oligomer_info[atom_in_mol_idx]
-
-                # Check Mismatch
-                if pdb_element != target_element:
-                    if not (pdb_element == target_element):  # Strict check
-                        print(f"\n[CRITICAL ERROR] Atom Mismatch (Oligomer) at line {line_num}!")
-                        print(f"  Expected: {target_name} ({target_element})")
-                        print(f"  Found: {pdb_element}")
-                        sys.exit(1)
-
-                # Extraction Logic
-                if extracting:
-                    f_extract.write(
-                        f"ATOM  {atom_in_mol_idx + 1:5d} {pdb_element:^4s} MOL     1    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-
-                atom_name = target_name
-                atom_in_mol_idx += 1
-
-                atom_counter += 1
-                # Buffer write
-                if atom_in_mol_idx == atoms_per_oligomer:
-                    residue_counter += 1
-                    current_residue_lines.append(
-                        f"ATOM  {atom_counter:5d} {atom_name:^4s} {res_name:3s} {residue_counter:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-                    current_residue_lines.append("TER\n")
-
-                    for l in current_residue_lines: fout.write(l)
-                    current_residue_lines = []
-
-                    if extracting:
-                        f_extract.close()
-                        extracting = False
-                        print(f"-> Successfully extracted '{extract_filename}'. Use this for Antechamber!")
-
-                    mol_idx += 1
-                    atom_in_mol_idx = 0
-                    if mol_idx == num_oligomers:
-                        current_mol_type = "ion" if num_ions > 0 else "water" if num_waters > 0 else "done"
-                        mol_idx = 0
-                else:
-                    current_residue_lines.append(
-                        f"ATOM  {atom_counter:5d} {atom_name:^4s} {res_name:3s} {residue_counter + 1:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-
-            elif current_mol_type == "ion":
-                res_name = ion_resname
-                atom_name = ion_atomname
-
-                if pdb_element != "Cl":
-                    print(f"\n[CRITICAL ERROR] Ion Mismatch at line {line_num}. Expected Cl, found {pdb_element}.")
-                    sys.exit(1)
-
-                atom_counter += 1
-                residue_counter += 1
-                fout.write(
-                    f"ATOM  {atom_counter:5d} {atom_name:^4s} {res_name:3s} {residue_counter:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-                fout.write("TER\n")
-
-                mol_idx += 1
-                if mol_idx == num_ions:
-                    current_mol_type = "water" if num_waters > 0 else "done"
-                    mol_idx = 0
-                    atom_in_mol_idx = 0
-
-            elif current_mol_type == "water":
-                res_name = water_resname
-                atom_name = water_atom_names[atom_in_mol_idx]
-                target_element = water_elements[atom_in_mol_idx]
-
-                if pdb_element != target_element:
-                    print(
-                        f"\n[CRITICAL ERROR] Water Mismatch at line {line_num}. Expected {target_element}, found {pdb_element}.")
-                    print("Possible missing atom in previous water molecule.")
-                    sys.exit(1)
-
-                atom_in_mol_idx += 1
-                atom_counter += 1
-
-                if atom_in_mol_idx == 3:
-                    residue_counter += 1
-                    current_residue_lines.append(
-                        f"ATOM  {atom_counter:5d} {atom_name:^4s} {res_name:3s} {residue_counter:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-                    current_residue_lines.append("TER\n")
-
-                    for l in current_residue_lines: fout.write(l)
-                    current_residue_lines = []
-
-                    mol_idx += 1
-                    atom_in_mol_idx = 0
-                    if mol_idx == num_waters:
-                        current_mol_type = "done"
-                else:
-                    current_residue_lines.append(
-                        f"ATOM  {atom_counter:5d} {atom_name:^4s} {res_name:3s} {residue_counter + 1:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
-
-        # End of loop
-        if current_residue_lines:
+            if end - atom_idx < 3:
+                incomplete = True
+                break
+
+            residue_counter += 1
+            write_residue(out_buf, atom_counter + 1, water_atom_names, water_resname,
+                          residue_counter, xs[atom_idx:end], ys[atom_idx:end], zs[atom_idx:end])
+            atom_counter += 3
+            atom_idx = end
+            if len(out_buf) >= WRITE_CHUNK_LINES:
+                fout.write("".join(out_buf))
+                out_buf.clear()
+
+        if incomplete:
             print(f"[WARNING] Unwritten incomplete residue lines found at end of file. Discarding.")
 
-        fout.write("END\n")
+        out_buf_append("END\n")
+        fout.write("".join(out_buf))
         print(f"Processing complete. Generated file: {output_pdb}")
         print(f"Total residues: {residue_counter}")
 